@@ -1,25 +1,107 @@
 from dotenv import load_dotenv
 load_dotenv()  # Load environment variables from .env file
 
+import os
+import logging
 import streamlit as st
 import uuid
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
 from rag import RAGSystem
-from db import FeedbackDatabase
+from db import FeedbackDatabase, ConversationWriter
+
+logging.basicConfig(level=os.environ.get("LOG_LEVEL", "INFO"))
+logger = logging.getLogger(__name__)
+
+
+@st.cache_resource
+def get_rag_system():
+    """Load the RAG system once and share it across all sessions"""
+    return RAGSystem()
+
+
+@st.cache_resource
+def get_feedback_db():
+    """Create the feedback database and its tables once for all sessions"""
+    feedback_db = FeedbackDatabase()
+    return feedback_db, feedback_db.init_table()
+
+
+@st.cache_resource
+def get_executor():
+    """Thread pool for evaluation and database writes that shouldn't block rendering"""
+    return ThreadPoolExecutor(max_workers=4)
+
+
+@st.cache_resource
+def get_conversation_writer(_feedback_db):
+    """Single background writer that batches conversation rows from all sessions"""
+    return ConversationWriter(_feedback_db)
+
+
+def log_background_error(future):
+    """Report exceptions raised by background tasks"""
+    if future.exception() is not None:
+        logger.error("Background task failed", exc_info=future.exception())
+
+
+def record_conversation(rag_system, conversation_writer, question, result, history_item, session_id=None):
+    """
+    Wait for the relevance evaluation of an answer and save the finished conversation
+    
+    Args:
+        rag_system: RAGSystem that produced the result
+        conversation_writer: ConversationWriter to save with, or None if the database is offline
+        question: User's question
+        result: Dict returned by RAGSystem.query
+        history_item: Conversation history entry to update with the evaluation
+        session_id: Optional session identifier
+    """
+    result = rag_system.finish_evaluation(question, result)
+    history_item['relevance'] = result['relevance']
+    history_item['openai_cost'] = result['openai_cost']
+    
+    if conversation_writer is None:
+        return
+    
+    # Written with other sessions' conversations in the writer's next batch
+    conversation_writer.put({
+        'conversation_id': str(uuid.uuid4()),
+        'question': question,
+        'answer': result['answer'],
+        'relevance': result['relevance'],
+        'relevance_explanation': result['relevance_explanation'],
+        'prompt_tokens': result['prompt_tokens'],
+        'completion_tokens': result['completion_tokens'],
+        'total_tokens': result['total_tokens'],
+        'eval_prompt_tokens': result['eval_prompt_tokens'],
+        'eval_completion_tokens': result['eval_completion_tokens'],
+        'eval_total_tokens': result['eval_total_tokens'],
+        'openai_cost': result['openai_cost'],
+        'response_time': result['response_time'],
+        'timestamp': datetime.now(),
+        'session_id': session_id,
+        'cached': result['cache']
+    })
+
+
+@st.cache_data(ttl=5)
+def get_feedback_stats(_feedback_db, session_id):
+    """Feedback stats for a session, cached briefly to spare Postgres on every rerun"""
+    return _feedback_db.get_feedback_stats(session_id)
 
 
 def initialize_session_state():
     """Initialize Streamlit session state variables"""
-    if 'rag_system' not in st.session_state:
-        st.session_state.rag_system = RAGSystem()
+    st.session_state.rag_system = get_rag_system()
     
-    if 'feedback_db' not in st.session_state:
-        st.session_state.feedback_db = FeedbackDatabase()
-        
-    if 'db_initialized' not in st.session_state:
-        # Try to initialize database
-        success, message = st.session_state.feedback_db.init_table()
-        st.session_state.db_initialized = success
-        st.session_state.db_error_message = message if not success else None
+    feedback_db, (success, message) = get_feedback_db()
+    if not success:
+        # Don't cache a failed initialization so the next session retries
+        get_feedback_db.clear()
+    st.session_state.feedback_db = feedback_db
+    st.session_state.db_initialized = success
+    st.session_state.db_error_message = message if not success else None
     
     if 'session_id' not in st.session_state:
         st.session_state.session_id = str(uuid.uuid4())
@@ -54,7 +136,7 @@ def display_feedback_buttons(idx, question, answer):
             ):
                 st.session_state.feedback_given[feedback_key] = 1
                 st.success("Thanks for your feedback!")
-                st.rerun()
+                st.rerun(scope="fragment")
     
     with col2:
         if st.button("👎 -1", key=f"minus_{idx}", disabled=feedback_key in st.session_state.feedback_given or not st.session_state.db_initialized):
@@ -66,7 +148,7 @@ def display_feedback_buttons(idx, question, answer):
             ):
                 st.session_state.feedback_given[feedback_key] = -1
                 st.warning("Thanks for your feedback!")
-                st.rerun()
+                st.rerun(scope="fragment")
     
     with col3:
         if feedback_key in st.session_state.feedback_given:
@@ -75,37 +157,8 @@ def display_feedback_buttons(idx, question, answer):
             st.caption(f"Feedback recorded: {emoji}")
 
 
-def main():
-    st.set_page_config(
-        page_title="KubeQuery RAG",
-        page_icon="☸️",
-        layout="wide"
-    )
-    
-    st.title("☸️ KubeQuery RAG Application")
-    st.markdown("Ask questions about Kubernetes and get AI-powered answers!")
-    
-    # Initialize session state
-    initialize_session_state()
-    
-    # Show database warning if not initialized
-    if not st.session_state.db_initialized:
-        st.warning(
-            f"⚠️ Database connection failed. Feedback features are disabled.\n\n"
-            f"Error: {st.session_state.db_error_message}\n\n"
-            f"The app will still work for Q&A, but feedback won't be saved."
-        )
-    
-    # Check if Elasticsearch index exists
-    if not st.session_state.rag_system.index_exists:
-        st.error(
-            f"❌ Elasticsearch index '{st.session_state.rag_system.index_name}' not found!\n\n"
-            f"Please run the indexing script first:\n\n"
-            f"```bash\npython index_documents.py\n```"
-        )
-        st.stop()
-    
-    # Sidebar with info
+def render_sidebar():
+    """Display app info, session info and feedback stats in the sidebar"""
     with st.sidebar:
         st.header("About")
         st.info(
@@ -123,7 +176,7 @@ def main():
         # Display feedback stats
         if st.session_state.db_initialized:
             try:
-                stats = st.session_state.feedback_db.get_feedback_stats(st.session_state.session_id)
+                stats = get_feedback_stats(st.session_state.feedback_db, st.session_state.session_id)
                 st.header("Feedback Stats")
                 st.metric("Total Feedback", stats['total'])
                 col1, col2 = st.columns(2)
@@ -135,54 +188,16 @@ def main():
                 st.caption("Feedback stats unavailable")
         else:
             st.caption("💾 Database offline - feedback disabled")
+
+
+@st.fragment
+def render_conversation_history():
+    """
+    Display conversation history with feedback buttons and sources
     
-    # Main input area
-    user_input = st.text_input("Enter your Kubernetes question:", placeholder="e.g., How do I deploy a pod?")
-    
-    if st.button("Ask", type="primary"):
-        if user_input.strip():
-            with st.spinner('🔍 Searching knowledge base and generating answer...'):
-                try:
-                    result = st.session_state.rag_system.query(user_input)
-                    
-                    # Save conversation to database for monitoring
-                    if st.session_state.db_initialized:
-                        conversation_id = str(uuid.uuid4())
-                        st.session_state.feedback_db.save_conversation(
-                            conversation_id=conversation_id,
-                            question=user_input,
-                            answer=result['answer'],
-                            relevance=result['relevance'],
-                            relevance_explanation=result['relevance_explanation'],
-                            prompt_tokens=result['prompt_tokens'],
-                            completion_tokens=result['completion_tokens'],
-                            total_tokens=result['total_tokens'],
-                            eval_prompt_tokens=result['eval_prompt_tokens'],
-                            eval_completion_tokens=result['eval_completion_tokens'],
-                            eval_total_tokens=result['eval_total_tokens'],
-                            openai_cost=result['openai_cost'],
-                            response_time=result['response_time'],
-                            session_id=st.session_state.session_id
-                        )
-                    
-                    # Add to conversation history
-                    st.session_state.conversation_history.append({
-                        'question': user_input,
-                        'answer': result['answer'],
-                        'search_results': result['search_results'],
-                        'relevance': result['relevance'],
-                        'response_time': result['response_time'],
-                        'openai_cost': result['openai_cost']
-                    })
-                    
-                    st.rerun()
-                    
-                except Exception as e:
-                    st.error(f"An error occurred: {str(e)}")
-        else:
-            st.warning("Please enter a question!")
-    
-    # Display conversation history
+    Runs as a fragment so that feedback clicks only rerender the history,
+    not the sidebar or the question input.
+    """
     if st.session_state.conversation_history:
         st.markdown("---")
         st.header("Conversation History")
@@ -208,5 +223,90 @@ def main():
                 st.markdown("---")
 
 
+def main():
+    st.set_page_config(
+        page_title="KubeQuery RAG",
+        page_icon="☸️",
+        layout="wide"
+    )
+    
+    st.title("☸️ KubeQuery RAG Application")
+    st.markdown("Ask questions about Kubernetes and get AI-powered answers!")
+    
+    # Initialize session state
+    initialize_session_state()
+    
+    # Show database warning if not initialized
+    if not st.session_state.db_initialized:
+        st.warning(
+            f"⚠️ Database connection failed. Feedback features are disabled.\n\n"
+            f"Error: {st.session_state.db_error_message}\n\n"
+            f"The app will still work for Q&A, but feedback won't be saved."
+        )
+    
+    # Check if Elasticsearch index exists; the RAG system is shared across
+    # sessions, so re-check a missing index instead of trusting the cached flag
+    rag_system = st.session_state.rag_system
+    if not rag_system.index_exists:
+        rag_system.index_exists = rag_system.check_index_exists()
+    if not rag_system.index_exists:
+        st.error(
+            f"❌ Elasticsearch index '{st.session_state.rag_system.index_name}' not found!\n\n"
+            f"Please run the indexing script first:\n\n"
+            f"```bash\npython index_documents.py\n```"
+        )
+        st.stop()
+    
+    # Main input area
+    user_input = st.text_input("Enter your Kubernetes question:", placeholder="e.g., How do I deploy a pod?")
+    
+    if st.button("Ask", type="primary"):
+        if user_input.strip():
+            try:
+                with st.spinner('🔍 Searching knowledge base...'):
+                    result = st.session_state.rag_system.query_stream(user_input)
+                
+                # Show the answer as it is generated; it moves into the history below
+                # once the stream completes
+                answer_placeholder = st.empty()
+                with answer_placeholder.container():
+                    st.markdown(f"**Q: {user_input}**")
+                    st.write_stream(result.pop('answer_stream'))
+                answer_placeholder.empty()
+                
+                # Add to conversation history; relevance is filled in once evaluated
+                history_item = {
+                    'question': user_input,
+                    'answer': result['answer'],
+                    'search_results': result['search_results'],
+                    'relevance': result.get('relevance'),
+                    'response_time': result['response_time'],
+                    'openai_cost': result['openai_cost']
+                }
+                st.session_state.conversation_history.append(history_item)
+                
+                # Finish the relevance evaluation and save the conversation for
+                # monitoring in the background
+                future = get_executor().submit(
+                    record_conversation,
+                    st.session_state.rag_system,
+                    get_conversation_writer(st.session_state.feedback_db) if st.session_state.db_initialized else None,
+                    user_input,
+                    result,
+                    history_item,
+                    st.session_state.session_id
+                )
+                future.add_done_callback(log_background_error)
+                
+            except Exception as e:
+                st.error(f"An error occurred: {str(e)}")
+        else:
+            st.warning("Please enter a question!")
+    
+    # Rendered after the Ask handler so the new answer shows without a rerun
+    render_sidebar()
+    render_conversation_history()
+
+
 if __name__ == "__main__":
     main()
\ No newline at end of file
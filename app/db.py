@@ -1,13 +1,43 @@
 import os
-import psycopg2
-from psycopg2.extras import DictCursor
+import time
+import queue
+import threading
+from contextlib import contextmanager
+from psycopg2.extensions import connection
+from psycopg2.extras import DictCursor, execute_values
+from psycopg2.pool import ThreadedConnectionPool
 from datetime import datetime
 import uuid
 
 
+# Server-side prepared statements for the inserts on the interactive path,
+# created once per pooled connection so Postgres skips parse and plan per insert.
+# Conversations are written in batches by save_conversations_batch instead.
+PREPARED_STATEMENTS = {
+    'feedback_ins': """
+        PREPARE feedback_ins (uuid, text, text, integer, timestamp, text) AS
+        INSERT INTO feedback (id, question, answer, feedback, timestamp, session_id)
+        VALUES ($1, $2, $3, $4, $5, $6)
+    """
+}
+
+
+class PreparingConnection(connection):
+    """Connection that remembers which prepared statements exist in its session"""
+    
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.prepared = set()
+
+
 class FeedbackDatabase:
     """Handle PostgreSQL database operations for user feedback and conversations"""
     
+    # Shared across instances so every Streamlit session reuses the same connections
+    _pool = None
+    _pool_slots = None
+    _pool_lock = threading.Lock()
+    
     def __init__(self):
         """Initialize database connection using environment variables"""
         self.connection_params = {
@@ -15,18 +45,57 @@ class FeedbackDatabase:
             'port': os.environ.get('POSTGRES_PORT', '5432'),
             'database': os.environ.get('POSTGRES_DB', 'rag_feedback'),
             'user': os.environ.get('POSTGRES_USER', 'postgres'),
-            'password': os.environ.get('POSTGRES_PASSWORD', '')
+            'password': os.environ.get('POSTGRES_PASSWORD', ''),
+            'connection_factory': PreparingConnection
         }
+        self.pool_max = int(os.environ.get('POSTGRES_POOL_MAX', '10'))
     
+    def get_pool(self):
+        """Get the shared connection pool, creating it on first use"""
+        cls = type(self)
+        if cls._pool is None:
+            with cls._pool_lock:
+                if cls._pool is None:
+                    # minconn == maxconn: putconn closes connections returned while
+                    # minconn are already idle, which would discard them (and their
+                    # prepared statements) instead of reusing them
+                    cls._pool = ThreadedConnectionPool(self.pool_max, self.pool_max, **self.connection_params)
+                    cls._pool_slots = threading.BoundedSemaphore(self.pool_max)
+        return cls._pool
+    
+    @contextmanager
     def get_connection(self):
-        """Get database connection"""
-        return psycopg2.connect(**self.connection_params)
+        """
+        Borrow a pooled connection, committing on success and rolling back on error
+        
+        Waits for a free connection when all of them are in use; the pool itself
+        would raise "connection pool exhausted" instead.
+        """
+        pool = self.get_pool()
+        slots = type(self)._pool_slots
+        with slots:
+            conn = pool.getconn()
+            try:
+                yield conn
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            finally:
+                pool.putconn(conn)
+    
+    def prepare(self, cursor, name):
+        """Create a prepared statement on the cursor's connection if it doesn't exist yet"""
+        if name not in cursor.connection.prepared:
+            cursor.execute(PREPARED_STATEMENTS[name])
+            cursor.connection.prepared.add(name)
     
     def test_connection(self):
         """Test database connection"""
         try:
-            conn = self.get_connection()
-            conn.close()
+            with self.get_connection() as conn:
+                with conn.cursor() as cursor:
+                    cursor.execute("SELECT 1")
             return True, "Connection successful"
         except Exception as e:
             return False, str(e)
@@ -58,23 +127,28 @@ class FeedbackDatabase:
             openai_cost DECIMAL(10, 6),
             response_time DECIMAL(10, 3),
             timestamp TIMESTAMP NOT NULL,
-            session_id TEXT
+            session_id TEXT,
+            cached BOOLEAN NOT NULL DEFAULT FALSE
         );
         
+        -- Added after the table was first released
+        ALTER TABLE conversations ADD COLUMN IF NOT EXISTS cached BOOLEAN NOT NULL DEFAULT FALSE;
+        
         CREATE INDEX IF NOT EXISTS idx_feedback_timestamp ON feedback(timestamp);
-        CREATE INDEX IF NOT EXISTS idx_feedback_session ON feedback(session_id);
-        CREATE INDEX IF NOT EXISTS idx_conversations_timestamp ON conversations(timestamp);
         CREATE INDEX IF NOT EXISTS idx_conversations_relevance ON conversations(relevance);
         CREATE INDEX IF NOT EXISTS idx_conversations_session ON conversations(session_id);
+        CREATE INDEX IF NOT EXISTS idx_feedback_session_covering ON feedback(session_id) INCLUDE (feedback);
+        CREATE INDEX IF NOT EXISTS idx_conversations_timestamp_covering ON conversations(timestamp) INCLUDE (relevance, response_time, openai_cost);
+        
+        -- Superseded by the covering indexes above, which have the same leading key
+        DROP INDEX IF EXISTS idx_feedback_session;
+        DROP INDEX IF EXISTS idx_conversations_timestamp;
         """
         
         try:
-            conn = self.get_connection()
-            cursor = conn.cursor()
-            cursor.execute(create_tables_query)
-            conn.commit()
-            cursor.close()
-            conn.close()
+            with self.get_connection() as conn:
+                with conn.cursor() as cursor:
+                    cursor.execute(create_tables_query)
             return True, "Database initialized successfully"
         except Exception as e:
             error_msg = f"Error initializing table: {e}"
@@ -84,7 +158,7 @@ class FeedbackDatabase:
     def save_conversation(self, conversation_id, question, answer, relevance, relevance_explanation,
                           prompt_tokens, completion_tokens, total_tokens,
                           eval_prompt_tokens, eval_completion_tokens, eval_total_tokens,
-                          openai_cost, response_time, session_id=None):
+                          openai_cost, response_time, session_id=None, cached=False):
         """
         Save conversation to database for monitoring
         
@@ -103,6 +177,7 @@ class FeedbackDatabase:
             openai_cost: Total cost in USD
             response_time: Response time in seconds
             session_id: Optional session identifier
+            cached: Whether the answer was served from a cache
             
         Returns:
             bool: True if successful, False otherwise
@@ -112,31 +187,71 @@ class FeedbackDatabase:
         (id, question, answer, relevance, relevance_explanation, 
          prompt_tokens, completion_tokens, total_tokens,
          eval_prompt_tokens, eval_completion_tokens, eval_total_tokens,
-         openai_cost, response_time, timestamp, session_id)
-        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+         openai_cost, response_time, timestamp, session_id, cached)
+        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
         """
         
         try:
-            conn = self.get_connection()
-            cursor = conn.cursor()
-            
             timestamp = datetime.now()
             
-            cursor.execute(insert_query, (
-                conversation_id, question, answer, relevance, relevance_explanation,
-                prompt_tokens, completion_tokens, total_tokens,
-                eval_prompt_tokens, eval_completion_tokens, eval_total_tokens,
-                openai_cost, response_time, timestamp, session_id
-            ))
-            
-            conn.commit()
-            cursor.close()
-            conn.close()
+            with self.get_connection() as conn:
+                with conn.cursor() as cursor:
+                    cursor.execute(insert_query, (
+                        conversation_id, question, answer, relevance, relevance_explanation,
+                        prompt_tokens, completion_tokens, total_tokens,
+                        eval_prompt_tokens, eval_completion_tokens, eval_total_tokens,
+                        openai_cost, response_time, timestamp, session_id, cached
+                    ))
             return True
         except Exception as e:
             print(f"Error saving conversation: {e}")
             return False
     
+    def save_conversations_batch(self, conversations, page_size=500):
+        """
+        Save many conversations in one transaction using multi-row INSERTs
+        
+        Args:
+            conversations: List of dicts with the same keys as save_conversation's
+                arguments (session_id, cached and timestamp are optional)
+            page_size: Maximum number of rows per INSERT statement
+            
+        Returns:
+            bool: True if successful, False otherwise
+        """
+        if not conversations:
+            return True
+        
+        insert_query = """
+        INSERT INTO conversations 
+        (id, question, answer, relevance, relevance_explanation, 
+         prompt_tokens, completion_tokens, total_tokens,
+         eval_prompt_tokens, eval_completion_tokens, eval_total_tokens,
+         openai_cost, response_time, timestamp, session_id, cached)
+        VALUES %s
+        """
+        
+        try:
+            timestamp = datetime.now()
+            rows = [
+                (
+                    c['conversation_id'], c['question'], c['answer'], c['relevance'], c['relevance_explanation'],
+                    c['prompt_tokens'], c['completion_tokens'], c['total_tokens'],
+                    c['eval_prompt_tokens'], c['eval_completion_tokens'], c['eval_total_tokens'],
+                    c['openai_cost'], c['response_time'], c.get('timestamp', timestamp), c.get('session_id'),
+                    c.get('cached', False)
+                )
+                for c in conversations
+            ]
+            
+            with self.get_connection() as conn:
+                with conn.cursor() as cursor:
+                    execute_values(cursor, insert_query, rows, page_size=page_size)
+            return True
+        except Exception as e:
+            print(f"Error saving conversations: {e}")
+            return False
+    
     def save_feedback(self, question, answer, feedback_value, session_id=None):
         """
         Save user feedback to database
@@ -151,29 +266,24 @@ class FeedbackDatabase:
             bool: True if successful, False otherwise
         """
         insert_query = """
-        INSERT INTO feedback (id, question, answer, feedback, timestamp, session_id)
-        VALUES (%s, %s, %s, %s, %s, %s)
+        EXECUTE feedback_ins (%s, %s, %s, %s, %s, %s)
         """
         
         try:
-            conn = self.get_connection()
-            cursor = conn.cursor()
-            
             feedback_id = str(uuid.uuid4())
             timestamp = datetime.now()
             
-            cursor.execute(insert_query, (
-                feedback_id,
-                question,
-                answer,
-                feedback_value,
-                timestamp,
-                session_id
-            ))
-            
-            conn.commit()
-            cursor.close()
-            conn.close()
+            with self.get_connection() as conn:
+                with conn.cursor() as cursor:
+                    self.prepare(cursor, 'feedback_ins')
+                    cursor.execute(insert_query, (
+                        feedback_id,
+                        question,
+                        answer,
+                        feedback_value,
+                        timestamp,
+                        session_id
+                    ))
             return True
         except Exception as e:
             print(f"Error saving feedback: {e}")
@@ -193,8 +303,8 @@ class FeedbackDatabase:
             query = """
             SELECT 
                 COUNT(*) as total,
-                SUM(CASE WHEN feedback = 1 THEN 1 ELSE 0 END) as positive,
-                SUM(CASE WHEN feedback = -1 THEN 1 ELSE 0 END) as negative
+                COUNT(*) FILTER (WHERE feedback = 1) as positive,
+                COUNT(*) FILTER (WHERE feedback = -1) as negative
             FROM feedback
             WHERE session_id = %s
             """
@@ -203,29 +313,26 @@ class FeedbackDatabase:
             query = """
             SELECT 
                 COUNT(*) as total,
-                SUM(CASE WHEN feedback = 1 THEN 1 ELSE 0 END) as positive,
-                SUM(CASE WHEN feedback = -1 THEN 1 ELSE 0 END) as negative
+                COUNT(*) FILTER (WHERE feedback = 1) as positive,
+                COUNT(*) FILTER (WHERE feedback = -1) as negative
             FROM feedback
             """
             params = None
         
         try:
-            conn = self.get_connection()
-            cursor = conn.cursor(cursor_factory=DictCursor)
-            
-            if params:
-                cursor.execute(query, params)
-            else:
-                cursor.execute(query)
-            
-            result = cursor.fetchone()
-            cursor.close()
-            conn.close()
+            with self.get_connection() as conn:
+                with conn.cursor() as cursor:
+                    if params:
+                        cursor.execute(query, params)
+                    else:
+                        cursor.execute(query)
+                    
+                    total, positive, negative = cursor.fetchone()
             
             return {
-                'total': result['total'] if result['total'] else 0,
-                'positive': result['positive'] if result['positive'] else 0,
-                'negative': result['negative'] if result['negative'] else 0
+                'total': total or 0,
+                'positive': positive or 0,
+                'negative': negative or 0
             }
         except Exception as e:
             print(f"Error getting feedback stats: {e}")
@@ -249,12 +356,10 @@ class FeedbackDatabase:
         """
         
         try:
-            conn = self.get_connection()
-            cursor = conn.cursor(cursor_factory=DictCursor)
-            cursor.execute(query, (limit,))
-            results = cursor.fetchall()
-            cursor.close()
-            conn.close()
+            with self.get_connection() as conn:
+                with conn.cursor(cursor_factory=DictCursor) as cursor:
+                    cursor.execute(query, (limit,))
+                    results = cursor.fetchall()
             
             return [dict(row) for row in results]
         except Exception as e:
@@ -274,22 +379,70 @@ class FeedbackDatabase:
             AVG(response_time) as avg_response_time,
             AVG(openai_cost) as avg_cost,
             SUM(openai_cost) as total_cost,
-            COUNT(CASE WHEN relevance = 'RELEVANT' THEN 1 END) as relevant_count,
-            COUNT(CASE WHEN relevance = 'PARTLY_RELEVANT' THEN 1 END) as partly_relevant_count,
-            COUNT(CASE WHEN relevance = 'NON_RELEVANT' THEN 1 END) as non_relevant_count
+            COUNT(*) FILTER (WHERE relevance = 'RELEVANT') as relevant_count,
+            COUNT(*) FILTER (WHERE relevance = 'PARTLY_RELEVANT') as partly_relevant_count,
+            COUNT(*) FILTER (WHERE relevance = 'NON_RELEVANT') as non_relevant_count
         FROM conversations
         WHERE timestamp >= NOW() - INTERVAL '24 hours'
         """
         
         try:
-            conn = self.get_connection()
-            cursor = conn.cursor(cursor_factory=DictCursor)
-            cursor.execute(query)
-            result = cursor.fetchone()
-            cursor.close()
-            conn.close()
+            with self.get_connection() as conn:
+                with conn.cursor() as cursor:
+                    cursor.execute(query)
+                    result = cursor.fetchone()
+            
+            if not result:
+                return {}
             
-            return dict(result) if result else {}
+            (total_conversations, avg_response_time, avg_cost, total_cost,
+             relevant_count, partly_relevant_count, non_relevant_count) = result
+            return {
+                'total_conversations': total_conversations,
+                'avg_response_time': avg_response_time,
+                'avg_cost': avg_cost,
+                'total_cost': total_cost,
+                'relevant_count': relevant_count,
+                'partly_relevant_count': partly_relevant_count,
+                'non_relevant_count': non_relevant_count
+            }
         except Exception as e:
             print(f"Error getting conversation stats: {e}")
-            return {}
\ No newline at end of file
+            return {}
+
+
+class ConversationWriter:
+    """
+    Batch conversation rows from all sessions into save_conversations_batch calls
+    
+    A single background thread owns the writes. It collects queued rows until
+    batch_size are pending or max_wait seconds have passed since the first one
+    arrived, then writes them in one transaction.
+    """
+    
+    def __init__(self, feedback_db, batch_size=50, max_wait=2.0):
+        self.feedback_db = feedback_db
+        self.batch_size = batch_size
+        self.max_wait = max_wait
+        self.pending = queue.Queue()
+        threading.Thread(target=self.run, daemon=True).start()
+    
+    def put(self, conversation):
+        """Queue one conversation (a dict as accepted by save_conversations_batch)"""
+        self.pending.put(conversation)
+    
+    def run(self):
+        """Collect and write batches until the process exits"""
+        while True:
+            batch = [self.pending.get()]
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self.pending.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            
+            self.feedback_db.save_conversations_batch(batch)
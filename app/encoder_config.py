@@ -0,0 +1,39 @@
+import os
+import platform
+
+
+def default_onnx_file():
+    """Pick the quantized ONNX export matching the CPU's fastest int8 instructions"""
+    if platform.machine().lower() in ('aarch64', 'arm64'):
+        return "onnx/model_qint8_arm64.onnx"
+
+    try:
+        with open('/proc/cpuinfo') as f_in:
+            flags = f_in.read()
+    except OSError:
+        flags = ''
+
+    if 'avx512_vnni' in flags:
+        return "onnx/model_qint8_avx512_vnni.onnx"
+    if 'avx512' in flags:
+        return "onnx/model_qint8_avx512.onnx"
+    return "onnx/model_quint8_avx2.onnx"
+
+
+def encoder_options():
+    """
+    Get the encoder backend and ONNX export to load
+
+    Shared by the app and the ingestion script, so query and document vectors
+    always come from the same encoder variant.
+
+    SENTENCE_TRANSFORMER_BACKEND selects "onnx" or "torch", and
+    SENTENCE_TRANSFORMER_ONNX_FILE selects which ONNX export to load.
+
+    Returns:
+        tuple: (backend, ONNX file name or None)
+    """
+    backend = os.environ.get("SENTENCE_TRANSFORMER_BACKEND", "onnx")
+    if backend != "onnx":
+        return backend, None
+    return backend, os.environ.get("SENTENCE_TRANSFORMER_ONNX_FILE") or default_onnx_file()
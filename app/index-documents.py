@@ -1,10 +1,13 @@
 import json
 import os
 from pathlib import Path
+import numpy as np
 from tqdm.auto import tqdm
 from sentence_transformers import SentenceTransformer
 from elasticsearch import Elasticsearch
+from elasticsearch.helpers import bulk
 from dotenv import load_dotenv
+from encoder_config import encoder_options
 
 # Load environment variables
 load_dotenv()
@@ -17,32 +20,66 @@ def load_documents(file_path='../data/docs-ids.json'):
     return documents
 
 
+VECTOR_FIELDS = ['title_vector', 'text_vector', 'title_text_vector']
+
+
 def encode_documents(documents, model_name='multi-qa-MiniLM-L6-cos-v1'):
-    """Encode documents with sentence transformers"""
+    """
+    Encode documents with sentence transformers
+    
+    Returns:
+        np.ndarray: float32 array of shape (len(documents), 3, dim) holding the
+        title, text and title+text vectors of each document, in VECTOR_FIELDS order
+    """
     print(f"Loading model: {model_name}")
-    model = SentenceTransformer(model_name)
+    # Must load the same encoder variant as the app so query and document vectors match
+    backend, onnx_file = encoder_options()
+    if backend == 'onnx':
+        model = SentenceTransformer(model_name, backend='onnx', model_kwargs={'file_name': onnx_file})
+    else:
+        model = SentenceTransformer(model_name, backend=backend)
+    dims = model.get_sentence_embedding_dimension()
+    
+    if not documents:
+        return np.empty((0, len(VECTOR_FIELDS), dims), dtype=np.float32)
     
     print("Encoding documents...")
-    for doc in tqdm(documents, desc="Encoding"):
-        title = doc['title']
-        text = doc['text']
-        title_text = title + ' ' + text
-        
-        doc['title_vector'] = model.encode(title).tolist()
-        doc['text_vector'] = model.encode(text).tolist()
-        doc['title_text_vector'] = model.encode(title_text).tolist()
+    # Encode title, text and title+text for every document in one batched call
+    texts = []
+    for doc in documents:
+        texts += [doc['title'], doc['text'], doc['title'] + ' ' + doc['text']]
     
-    return documents
+    embeddings = model.encode(
+        texts,
+        batch_size=64,
+        convert_to_numpy=True,
+        normalize_embeddings=True,
+        show_progress_bar=True
+    )
+    
+    # Keep vectors in one contiguous array instead of per-document Python lists
+    return embeddings.astype(np.float32).reshape(len(documents), len(VECTOR_FIELDS), dims)
 
 
-def create_index(es_client, index_name):
-    """Create Elasticsearch index with proper mappings"""
+def create_index(es_client, index_name, vector_index_type='int8_hnsw'):
+    """
+    Create Elasticsearch index with proper mappings
+    
+    vector_index_type is the HNSW variant for the dense vectors: int8_hnsw
+    (1 byte per dimension) or int4_hnsw (half a byte, at some cost in recall).
+    """
+    vector_index_options = {"type": vector_index_type, "m": 16, "ef_construction": 100}
+    # Vectors are L2-normalized when encoded, so dot_product ranks like cosine
+    # without recomputing magnitudes for every candidate
     index_settings = {
         "settings": {
             "number_of_shards": 1,
             "number_of_replicas": 0
         },
         "mappings": {
+            # Vectors are only needed for the HNSW graphs; keep them out of the
+            # stored source so search hits never carry them
+            "_source": {"excludes": VECTOR_FIELDS},
             "properties": {
                 "text": {"type": "text"},
                 "title": {"type": "keyword"},
@@ -52,19 +89,22 @@ def create_index(es_client, index_name):
                     "type": "dense_vector",
                     "dims": 384,
                     "index": True,
-                    "similarity": "cosine"
+                    "similarity": "dot_product",
+                    "index_options": vector_index_options
                 },
                 "text_vector": {
                     "type": "dense_vector",
                     "dims": 384,
                     "index": True,
-                    "similarity": "cosine"
+                    "similarity": "dot_product",
+                    "index_options": vector_index_options
                 },
                 "title_text_vector": {
                     "type": "dense_vector",
                     "dims": 384,
                     "index": True,
-                    "similarity": "cosine"
+                    "similarity": "dot_product",
+                    "index_options": vector_index_options
                 },
             }
         }
@@ -80,13 +120,27 @@ def create_index(es_client, index_name):
     es_client.indices.create(index=index_name, body=index_settings)
 
 
-def index_documents(es_client, documents, index_name):
-    """Index documents into Elasticsearch"""
+def index_documents(es_client, documents, vectors, index_name, chunk_size=500):
+    """Index documents and their vectors into Elasticsearch using the bulk API"""
     print("Indexing documents...")
-    for doc in tqdm(documents, desc="Indexing"):
-        es_client.index(index=index_name, document=doc)
     
-    print(f"Successfully indexed {len(documents)} documents!")
+    def actions():
+        for doc, doc_vectors in tqdm(zip(documents, vectors), total=len(documents), desc="Indexing"):
+            # Vectors are only converted to lists as each document is serialized
+            source = dict(doc)
+            for field, vector in zip(VECTOR_FIELDS, doc_vectors):
+                source[field] = vector.tolist()
+            yield {"_index": index_name, "_source": source}
+    
+    # Disable refreshes during the bulk load and refresh once at the end
+    es_client.indices.put_settings(index=index_name, settings={"index": {"refresh_interval": "-1"}})
+    try:
+        success, _ = bulk(es_client, actions(), chunk_size=chunk_size, request_timeout=60)
+    finally:
+        es_client.indices.put_settings(index=index_name, settings={"index": {"refresh_interval": "1s"}})
+        es_client.indices.refresh(index=index_name)
+    
+    print(f"Successfully indexed {success} documents!")
 
 
 def main():
@@ -95,6 +149,7 @@ def main():
     index_name = os.environ.get('ELASTICSEARCH_INDEX', 'k8s-questions')
     model_name = os.environ.get('SENTENCE_TRANSFORMER_MODEL', 'multi-qa-MiniLM-L6-cos-v1')
     docs_path = os.environ.get('DOCS_PATH', '../data/docs-ids.json')
+    vector_index_type = os.environ.get('VECTOR_INDEX_TYPE', 'int8_hnsw')
     
     print("=" * 50)
     print("Kubernetes Q&A Indexing Script")
@@ -102,6 +157,7 @@ def main():
     print(f"Elasticsearch: {es_host}")
     print(f"Index name: {index_name}")
     print(f"Model: {model_name}")
+    print(f"Vector index: {vector_index_type}")
     print(f"Documents: {docs_path}")
     print("=" * 50)
     
@@ -138,15 +194,15 @@ def main():
         print(f"✓ Loaded {len(documents)} documents")
         
         # Encode documents
-        documents = encode_documents(documents, model_name)
+        vectors = encode_documents(documents, model_name)
         print("✓ Encoded all documents")
         
         # Create index
-        create_index(es_client, index_name)
+        create_index(es_client, index_name, vector_index_type)
         print("✓ Index created")
         
         # Index documents
-        index_documents(es_client, documents, index_name)
+        index_documents(es_client, documents, vectors, index_name)
         print("✓ Documents indexed")
         
         print("\n" + "=" * 50)
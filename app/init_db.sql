@@ -26,12 +26,13 @@ CREATE TABLE IF NOT EXISTS conversations (
     openai_cost DECIMAL(10, 6),
     response_time DECIMAL(10, 3),
     timestamp TIMESTAMP NOT NULL,
-    session_id TEXT
+    session_id TEXT,
+    cached BOOLEAN NOT NULL DEFAULT FALSE
 );
 
 -- Create indexes for better query performance
 CREATE INDEX IF NOT EXISTS idx_feedback_timestamp ON feedback(timestamp);
-CREATE INDEX IF NOT EXISTS idx_feedback_session ON feedback(session_id);
-CREATE INDEX IF NOT EXISTS idx_conversations_timestamp ON conversations(timestamp);
 CREATE INDEX IF NOT EXISTS idx_conversations_relevance ON conversations(relevance);
-CREATE INDEX IF NOT EXISTS idx_conversations_session ON conversations(session_id);
\ No newline at end of file
+CREATE INDEX IF NOT EXISTS idx_conversations_session ON conversations(session_id);
+CREATE INDEX IF NOT EXISTS idx_feedback_session_covering ON feedback(session_id) INCLUDE (feedback);
+CREATE INDEX IF NOT EXISTS idx_conversations_timestamp_covering ON conversations(timestamp) INCLUDE (relevance, response_time, openai_cost);
\ No newline at end of file
@@ -1,99 +1,604 @@
 import os
 import time
 import json
-from elasticsearch import Elasticsearch
+import hashlib
+import logging
+import queue
+import threading
+from functools import lru_cache
+import diskcache
+import httpx
+import numpy as np
+from concurrent.futures import Future, ThreadPoolExecutor
+from elasticsearch import Elasticsearch, NotFoundError
 from sentence_transformers import SentenceTransformer
-from openai import OpenAI
+from openai import NOT_GIVEN, OpenAI
+from encoder_config import encoder_options
+
+logger = logging.getLogger(__name__)
+
+# Bump whenever build_prompt, evaluate_relevance or the answer model changes
+# so previously cached answers are no longer served (changes to the query
+# expansion tables are picked up through EXPANSIONS_DIGEST)
+PROMPT_VERSION = "v3"
+
+# A two-field relevance classification doesn't need the answer model
+EVALUATION_MODEL = "gpt-4o-mini"
+
+# Static instructions are sent as the system message, ahead of any per-request
+# text, so OpenAI's prefix-based prompt caching can reuse them across calls
+ANSWER_INSTRUCTIONS = """
+You are a Kubernetes assistant. Use ONLY the information in the "context" to answer the user's question.
+
+REQUIREMENTS:
+- Output ONLY raw Markdown text (no surrounding quotes, no JSON, no markdown in a string).
+- Use literal line breaks for paragraphs and fenced code blocks for commands (```bash ... ```).
+- Do NOT include backslash-n sequences ("\n") to indicate newlines — use real newlines.
+- Do not escape code blocks or wrap them in a string.
+- Return the answer only (no meta commentary).
+
+Example of desired output:
+To apply a YAML file in Kubernetes, use the following command:
+
+```bash
+kubectl apply -f FILENAME.yaml
+```
+""".strip()
+
+PROMPT_TEMPLATE = """
+Context:
+{context}
+
+User's Question:
+{question}
+
+Answer:
+""".strip()
+
+EVALUATION_INSTRUCTIONS = """
+You are an expert evaluator for a Retrieval-Augmented Generation (RAG) system.
+Your task is to analyze the relevance of the generated answer to the given question.
+Based on the relevance of the generated answer, you will classify it
+as "NON_RELEVANT", "PARTLY_RELEVANT", or "RELEVANT".
+
+The data for evaluation follows the "---" delimiter.
+
+Please analyze the content and context of the generated answer in relation to the question
+and provide your evaluation in parsable JSON without using code blocks:
+
+{
+  "Relevance": "NON_RELEVANT" | "PARTLY_RELEVANT" | "RELEVANT",
+  "Explanation": "[Provide a brief explanation for your evaluation]"
+}
+""".strip()
+
+EVALUATION_TEMPLATE = """
+---
+Question: {question}
+Generated Answer: {answer}
+""".strip()
+
+BATCH_EVALUATION_INSTRUCTIONS = """
+You are an expert evaluator for a Retrieval-Augmented Generation (RAG) system.
+Your task is to analyze the relevance of each generated answer to its question.
+Based on the relevance of the generated answer, you will classify it
+as "NON_RELEVANT", "PARTLY_RELEVANT", or "RELEVANT".
+
+The data for evaluation follows, one question and answer pair after each "---" delimiter.
+
+Please analyze the content and context of each generated answer in relation to its question
+and provide your evaluations in parsable JSON without using code blocks, as an array
+with one object per pair, in the same order as the pairs:
+
+[
+  {
+    "Relevance": "NON_RELEVANT" | "PARTLY_RELEVANT" | "RELEVANT",
+    "Explanation": "[Provide a brief explanation for your evaluation]"
+  }
+]
+""".strip()
+
+# kubectl short names and common abbreviations, expanded to the resource names
+# used in the documentation before searching. Only names that can't be read
+# as ordinary English words belong here.
+QUERY_EXPANSIONS = {
+    'k8s': 'kubernetes',
+    'po': 'pod',
+    'svc': 'service',
+    'ns': 'namespace',
+    'rs': 'replicaset',
+    'sts': 'statefulset',
+    'ds': 'daemonset',
+    'cm': 'configmap',
+    'sa': 'serviceaccount',
+    'pv': 'persistentvolume',
+    'pvc': 'persistentvolumeclaim',
+    'sc': 'storageclass',
+    'ing': 'ingress',
+    'hpa': 'horizontalpodautoscaler',
+    'crd': 'customresourcedefinition',
+    'netpol': 'networkpolicy',
+    'cj': 'cronjob',
+    'ep': 'endpoints',
+    'rbac': 'role-based access control',
+}
+
+# Short names that are also common words ("deploy"), only expanded in kubectl
+# resource references such as "deploy/nginx"
+RESOURCE_REFERENCE_EXPANSIONS = {
+    **QUERY_EXPANSIONS,
+    'deploy': 'deployment',
+}
+
+# Part of the answer cache key, so editing either table retires answers
+# retrieved with the old expansions
+EXPANSIONS_DIGEST = hashlib.sha256(
+    json.dumps([QUERY_EXPANSIONS, RESOURCE_REFERENCE_EXPANSIONS], sort_keys=True).encode('utf-8')
+).hexdigest()[:12]
+
+# Hybrid search query stored on the cluster as a mustache search template, so
+# each search only sends the template id and its parameters. The keyword
+# fields are read from doc values; only text and source_file come from _source.
+SEARCH_TEMPLATE_ID = "k8s_hybrid"
+
+SEARCH_TEMPLATE = """
+{
+  "knn": {
+    "field": "{{field}}",
+    "query_vector": {{#toJson}}query_vector{{/toJson}},
+    "k": {{k}},
+    "num_candidates": {{num_candidates}},
+    "boost": 0.5
+  },
+  "query": {
+    "bool": {
+      "must": {
+        "multi_match": {
+          "query": "{{query}}",
+          "fields": ["title", "text"],
+          "type": "best_fields",
+          "boost": 0.5
+        }
+      }
+    }
+  },
+  "size": {{k}},
+  "_source": ["text", "source_file"],
+  "docvalue_fields": ["title", "id"]
+}
+""".strip()
+
+# Same kNN and keyword queries, fused with Elasticsearch's native Reciprocal
+# Rank Fusion instead of summing boosted scores
+RRF_SEARCH_TEMPLATE_ID = "k8s_hybrid_rrf"
+
+RRF_SEARCH_TEMPLATE = """
+{
+  "retriever": {
+    "rrf": {
+      "retrievers": [
+        {
+          "standard": {
+            "query": {
+              "multi_match": {
+                "query": "{{query}}",
+                "fields": ["title", "text"],
+                "type": "best_fields"
+              }
+            }
+          }
+        },
+        {
+          "knn": {
+            "field": "{{field}}",
+            "query_vector": {{#toJson}}query_vector{{/toJson}},
+            "k": {{k}},
+            "num_candidates": {{num_candidates}}
+          }
+        }
+      ],
+      "rank_window_size": 50,
+      "rank_constant": 20
+    }
+  },
+  "size": {{k}},
+  "_source": ["text", "source_file"],
+  "docvalue_fields": ["title", "id"]
+}
+""".strip()
+
+
+def hit_document(hit):
+    """Merge a search hit's _source with its doc value fields into one document"""
+    doc = dict(hit.get('_source', {}))
+    for name, values in hit.get('fields', {}).items():
+        doc[name] = values[0]
+    return doc
+
+
+@lru_cache(maxsize=1)
+def load_encoder(model_name):
+    """
+    Load the sentence encoder, by default as an int8-quantized ONNX Runtime model
+    
+    The model is loaded once per process and shared by every RAGSystem.
+    """
+    backend, onnx_file = encoder_options()
+    if backend != "onnx":
+        return SentenceTransformer(model_name, backend=backend)
+    
+    return SentenceTransformer(model_name, backend="onnx", model_kwargs={"file_name": onnx_file})
+
+
+class EncodeBatcher:
+    """
+    Micro-batch encode requests from concurrent sessions into single model calls
+    
+    A background thread waits up to max_wait seconds to gather at most
+    max_batch pending texts, encodes them with one model.encode() call and
+    hands each caller its own vector.
+    """
+    
+    def __init__(self, model, max_batch=32, max_wait=0.005):
+        self.model = model
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.pending = queue.Queue()
+        threading.Thread(target=self.run, daemon=True).start()
+    
+    def submit(self, text):
+        """Queue one text for encoding and return a Future for its vector"""
+        future = Future()
+        self.pending.put((text, future))
+        return future
+    
+    def encode(self, text):
+        """Encode one text, blocking until its batch has been processed"""
+        return self.submit(text).result()
+    
+    def run(self):
+        """Collect and encode batches until the process exits"""
+        while True:
+            batch = [self.pending.get()]
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self.pending.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            
+            texts = [text for text, _ in batch]
+            try:
+                vectors = self.model.encode(
+                    texts,
+                    batch_size=self.max_batch,
+                    convert_to_numpy=True,
+                    normalize_embeddings=True
+                )
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            
+            for (_, future), vector in zip(batch, vectors):
+                future.set_result(vector)
+
+
+class SemanticCache:
+    """
+    In-memory cache of query results keyed by normalized query embeddings
+    
+    A lookup returns the stored result of the most similar earlier query if
+    its cosine similarity reaches the threshold and the entry hasn't expired.
+    Once full, the oldest entry is replaced.
+    """
+    
+    def __init__(self, dims, maxsize=1024, ttl=3600, threshold=0.95):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.threshold = threshold
+        self.vectors = np.zeros((maxsize, dims), dtype=np.float32)
+        self.values = [None] * maxsize
+        self.added_at = np.full(maxsize, -np.inf)
+        self.next_slot = 0
+        self.lock = threading.Lock()
+    
+    def search(self, vector):
+        """
+        Find the cached result for the most similar query
+        
+        Returns:
+            tuple: (result or None, similarity score)
+        """
+        vector = np.asarray(vector, dtype=np.float32)
+        with self.lock:
+            # Vectors are L2-normalized, so the dot product is the cosine similarity
+            scores = self.vectors @ vector
+            scores[self.added_at < time.monotonic() - self.ttl] = -1.0
+            best = int(np.argmax(scores))
+            if scores[best] < self.threshold:
+                return None, float(scores[best])
+            return self.values[best], float(scores[best])
+    
+    def add(self, vector, value):
+        """Store a result under its query vector"""
+        with self.lock:
+            slot = self.next_slot
+            self.vectors[slot] = vector
+            self.values[slot] = value
+            self.added_at[slot] = time.monotonic()
+            self.next_slot = (slot + 1) % self.maxsize
+
+
+@lru_cache(maxsize=1)
+def create_openai_client():
+    """Create the process-wide OpenAI client over a keep-alive HTTP/2 connection pool"""
+    http_client = httpx.Client(
+        http2=True,
+        limits=httpx.Limits(max_connections=100, max_keepalive_connections=50),
+        timeout=60
+    )
+    return OpenAI(api_key=os.environ.get("OPENAI_API_KEY"), http_client=http_client)
+
+
+@lru_cache(maxsize=1)
+def create_es_client():
+    """Create the process-wide Elasticsearch client with keep-alive connection pooling and compression"""
+    es_host = os.environ.get("ELASTICSEARCH_HOST", "http://localhost:9200")
+    return Elasticsearch(
+        es_host,
+        http_compress=True,
+        connections_per_node=32,
+        max_retries=2,
+        retry_on_timeout=True,
+        request_timeout=10,
+        sniff_on_start=False
+    )
 
 
 class RAGSystem:
     def __init__(self):
-        """Initialize RAG system with Elasticsearch, OpenAI, and SentenceTransformer"""
-        self.client = OpenAI(api_key=os.environ.get("OPENAI_API_KEY"))
+        """
+        Initialize RAG system with Elasticsearch, OpenAI, and SentenceTransformer
         
-        es_host = os.environ.get("ELASTICSEARCH_HOST", "http://localhost:9200")
-        self.es_client = Elasticsearch(es_host)
+        The clients and the encoder are process-wide singletons shared by every instance.
+        """
+        self.client = create_openai_client()
         
-        model_name = os.environ.get("SENTENCE_TRANSFORMER_MODEL", "multi-qa-MiniLM-L6-cos-v1")
-        self.model = SentenceTransformer(model_name)
+        self.es_client = create_es_client()
+        
+        self.model_name = os.environ.get("SENTENCE_TRANSFORMER_MODEL", "multi-qa-MiniLM-L6-cos-v1")
+        self.model = load_encoder(self.model_name)
+        self.encoder_backend, self.encoder_onnx_file = encoder_options()
+        self.encode_batcher = EncodeBatcher(self.model)
+        self.cached_encode = lru_cache(maxsize=1024)(self._encode)
         
         self.index_name = os.environ.get("ELASTICSEARCH_INDEX", "k8s-questions")
+        self.search_template_stored = False
+        
+        # HYBRID_RANKING=rrf fuses kNN and keyword hits with native RRF instead of
+        # the default boosted score sum that was evaluated in the notebooks. RRF
+        # needs an Enterprise (or trial) license, so fall back to linear without one
+        if os.environ.get("HYBRID_RANKING", "linear") == "rrf" and self.rrf_licensed():
+            self.search_template_id = RRF_SEARCH_TEMPLATE_ID
+            self.search_template = RRF_SEARCH_TEMPLATE
+        else:
+            self.search_template_id = SEARCH_TEMPLATE_ID
+            self.search_template = SEARCH_TEMPLATE
+        
+        # Number of extra LLM reformulations to retrieve with (0 disables multi-query retrieval)
+        self.multi_query_variants = int(os.environ.get("MULTI_QUERY_VARIANTS", "0"))
+        self.cached_query_variants = lru_cache(maxsize=256)(self._query_variants)
+        
+        # Persistent cache of full query results, shared by all sessions on this host
+        cache_dir = os.environ.get("ANSWER_CACHE_DIR", "/tmp/kubequery-cache")
+        self.answer_cache = diskcache.Cache(cache_dir, size_limit=1 << 30)
+        self.answer_cache_ttl = int(os.environ.get("ANSWER_CACHE_TTL", "86400"))
         
-        # OpenAI pricing (per 1M tokens) - GPT-4o
+        # Serves near-duplicate questions without retrieval or generation. Off
+        # unless SEMANTIC_CACHE_THRESHOLD is set: close paraphrases such as
+        # "scale up" and "scale down" can exceed any untuned threshold
+        self.semantic_cache = None
+        semantic_cache_threshold = os.environ.get("SEMANTIC_CACHE_THRESHOLD")
+        if semantic_cache_threshold:
+            self.semantic_cache = SemanticCache(
+                self.model.get_sentence_embedding_dimension(),
+                threshold=float(semantic_cache_threshold)
+            )
+        
+        # Runs relevance evaluations off the user-facing critical path
+        self.executor = ThreadPoolExecutor(max_workers=4)
+        
+        # OpenAI pricing (per 1M tokens) - GPT-4o for answers, GPT-4o mini for evaluation
         self.pricing = {
             'gpt-4o': {
                 'prompt': 2.50,  # $2.50 per 1M input tokens
                 'completion': 10.00  # $10.00 per 1M output tokens
+            },
+            'gpt-4o-mini': {
+                'prompt': 0.15,  # $0.15 per 1M input tokens
+                'completion': 0.60  # $0.60 per 1M output tokens
             }
         }
         
         # Check if index exists - initialize to False by default
         self.index_exists = False
+        self.index_checked_at = 0.0
+        self.index_check_ttl = 60
         try:
             self.index_exists = self.check_index_exists()
         except Exception as e:
-            print(f"Warning: Could not check index existence: {e}")
+            logger.warning("Could not check index existence: %s", e)
+    
+    def rrf_licensed(self):
+        """Check whether the cluster's license allows native RRF ranking"""
+        try:
+            license_type = self.es_client.license.get()['license']['type']
+        except Exception as e:
+            # Keep the configured ranking; searches will report any license error
+            logger.warning("Could not read the Elasticsearch license: %s", e)
+            return True
+        
+        if license_type not in ('enterprise', 'trial'):
+            logger.warning(
+                "HYBRID_RANKING=rrf needs an Enterprise or trial license, but the cluster has a %s "
+                "license; using linear ranking instead", license_type
+            )
+            return False
+        return True
     
     def check_index_exists(self):
         """Check if Elasticsearch index exists"""
+        self.index_checked_at = time.monotonic()
         try:
             return self.es_client.indices.exists(index=self.index_name)
         except Exception as e:
-            print(f"Error checking index: {e}")
+            logger.error("Error checking index: %s", e)
             return False
     
-    def elastic_search(self, field, query, vector):
+    def _encode(self, text):
+        """Encode text to an immutable vector so it can be memoized"""
+        return tuple(self.encode_batcher.encode(text).tolist())
+    
+    def encode_query(self, query):
+        """
+        Encode a query to a vector, reusing cached vectors for repeated queries
+        
+        Args:
+            query: Query text
+            
+        Returns:
+            Tuple of floats, already L2-normalized and ready to serialize as the
+            kNN query vector (shared with the cache, so it is immutable)
+        """
+        # The model is uncased, so case and surrounding whitespace don't change the vector
+        return self.cached_encode(query.strip().lower())
+    
+    def store_search_template(self):
+        """Store (or overwrite) the hybrid search template on the Elasticsearch cluster"""
+        self.es_client.put_script(
+            id=self.search_template_id,
+            script={"lang": "mustache", "source": self.search_template}
+        )
+        self.search_template_stored = True
+    
+    def elastic_search(self, field, query, vector, k=5, num_candidates=None):
         """
         Perform hybrid search using both vector (knn) and keyword search
         
         Args:
             field: Field name for vector search
             query: Text query for keyword search
-            vector: Query vector for knn search
+            vector: Normalized query vector for knn search, as returned by encode_query
+            k: Number of documents to return
+            num_candidates: HNSW candidates per shard (defaults to max(50, 20 * k))
             
         Returns:
             List of documents from search results
         """
-        knn_query = {
-            "field": field,
-            "query_vector": vector,
-            "k": 5,
-            "num_candidates": 10000,
-            "boost": 0.5
-        }
-
-        keyword_query = {
-            "bool": {
-                "must": {
-                    "multi_match": {
-                        "query": query,
-                        "fields": ["title", "text"],
-                        "type": "best_fields",
-                        "boost": 0.5,
-                    }
-                }
-            }
-        }
-
-        es_results = self.es_client.search(
+        if num_candidates is None:
+            num_candidates = max(50, 20 * k)
+        
+        if not self.search_template_stored:
+            self.store_search_template()
+        
+        es_results = self.es_client.search_template(
             index=self.index_name,
-            knn=knn_query,
-            query=keyword_query,
-            size=5,
-            _source=["text", "title", "source_file", "id"]
+            id=self.search_template_id,
+            params={
+                "field": field,
+                "query": query,
+                "query_vector": vector,
+                "k": k,
+                "num_candidates": num_candidates
+            },
+            # Only the hit documents are used; skip the response metadata
+            filter_path=["hits.hits._source", "hits.hits.fields"]
         )
 
         result_docs = []
         
-        for hit in es_results['hits']['hits']:
-            result_docs.append(hit['_source'])
+        # filter_path drops the hits key entirely when nothing matched
+        for hit in es_results.get('hits', {}).get('hits', []):
+            result_docs.append(hit_document(hit))
 
         return result_docs
 
+    def multi_query_search(self, field, queries, k=5, rank_constant=60):
+        """
+        Run the hybrid search for several query variants in a single msearch
+        request and fuse the rankings with Reciprocal Rank Fusion
+        
+        Args:
+            field: Field name for vector search
+            queries: Query variants to search with
+            k: Number of documents to return
+            rank_constant: RRF rank constant
+            
+        Returns:
+            List of documents from the fused results
+        """
+        if not self.search_template_stored:
+            self.store_search_template()
+        
+        # Queue all variants before waiting so they are batched into one model
+        # call, without waiting behind background evaluations on self.executor
+        futures = [self.encode_batcher.submit(query.strip().lower()) for query in queries]
+        vectors = [tuple(future.result().tolist()) for future in futures]
+        
+        search_templates = []
+        for query, vector in zip(queries, vectors):
+            search_templates.append({})
+            search_templates.append({
+                "id": self.search_template_id,
+                "params": {
+                    "field": field,
+                    "query": query,
+                    "query_vector": vector,
+                    "k": 2 * k,
+                    "num_candidates": max(50, 40 * k)
+                }
+            })
+        
+        es_results = self.es_client.msearch_template(
+            index=self.index_name,
+            search_templates=search_templates,
+            # Keep per-search errors: msearch reports them inside a 200 response
+            filter_path=[
+                "responses.error",
+                "responses.hits.hits._id",
+                "responses.hits.hits._source",
+                "responses.hits.hits.fields"
+            ]
+        )
+        
+        scores = {}
+        docs = {}
+        for response in es_results.get('responses', []):
+            error = response.get('error')
+            if error is not None:
+                # A missing stored template is stored again on the next search
+                if error.get('type') == 'resource_not_found_exception':
+                    self.search_template_stored = False
+                raise Exception(f"Multi-query search failed: {error.get('reason', error)}")
+            
+            for rank, hit in enumerate(response.get('hits', {}).get('hits', []), 1):
+                scores[hit['_id']] = scores.get(hit['_id'], 0) + 1 / (rank_constant + rank)
+                docs[hit['_id']] = hit_document(hit)
+        
+        top_ids = sorted(scores, key=scores.get, reverse=True)[:k]
+        return [docs[doc_id] for doc_id in top_ids]
+
     def build_prompt(self, query, search_results):
         """
         Build prompt for LLM using query and search results
         
+        The prompt only holds the per-request context and question; the static
+        instructions are sent separately as ANSWER_INSTRUCTIONS.
+        
         Args:
             query: User's question
             search_results: List of relevant documents
@@ -101,54 +606,31 @@ class RAGSystem:
         Returns:
             Formatted prompt string
         """
-        prompt_template = """
-You are a Kubernetes assistant. Use ONLY the information in the "context" to answer the user's question.
-
-REQUIREMENTS:
-- Output ONLY raw Markdown text (no surrounding quotes, no JSON, no markdown in a string).
-- Use literal line breaks for paragraphs and fenced code blocks for commands (```bash ... ```).
-- Do NOT include backslash-n sequences ("\n") to indicate newlines — use real newlines.
-- Do not escape code blocks or wrap them in a string.
-- Return the answer only (no meta commentary).
-
-Example of desired output:
-To apply a YAML file in Kubernetes, use the following command:
-
-```bash
-kubectl apply -f FILENAME.yaml
-```
-
-Context:
-{context}
-
-User's Question:
-{question}
-
-Answer:
-""".strip()
-
-        context = ""
-        
-        for doc in search_results:
-            context = context + f"title: {doc['title']}\nanswer: {doc['text']}\n\n"
+        context = "".join(
+            f"title: {doc['title']}\nanswer: {doc['text']}\n\n" for doc in search_results
+        )
         
-        prompt = prompt_template.format(question=query, context=context).strip()
-        return prompt
+        # PROMPT_TEMPLATE is stripped once at import and starts and ends with fixed
+        # text, so the formatted prompt needs no further strip()
+        return PROMPT_TEMPLATE.format(question=query, context=context)
 
-    def llm(self, prompt, model='gpt-4o'):
+    def llm(self, prompt, model='gpt-4o', system=None, json_output=False):
         """
         Get response from OpenAI LLM
         
         Args:
             prompt: Formatted prompt string
             model: OpenAI model to use
+            system: Optional static system message sent before the prompt
+            json_output: Constrain the response to a single JSON object
             
         Returns:
             tuple: (response_text, prompt_tokens, completion_tokens, total_tokens)
         """
         response = self.client.chat.completions.create(
             model=model,
-            messages=[{"role": "user", "content": prompt}]
+            messages=self.build_messages(prompt, system),
+            response_format={"type": "json_object"} if json_output else NOT_GIVEN
         )
         
         # Extract token usage
@@ -161,6 +643,46 @@ Answer:
             usage.total_tokens
         )
     
+    def llm_stream(self, prompt, usage, model='gpt-4o', system=None):
+        """
+        Stream a response from OpenAI LLM as it is generated
+        
+        Args:
+            prompt: Formatted prompt string
+            usage: Dict that receives prompt_tokens, completion_tokens and
+                total_tokens once the stream has finished
+            model: OpenAI model to use
+            system: Optional static system message sent before the prompt
+            
+        Yields:
+            str: Chunks of the response text
+        """
+        response = self.client.chat.completions.create(
+            model=model,
+            messages=self.build_messages(prompt, system),
+            stream=True,
+            stream_options={"include_usage": True}
+        )
+        
+        for chunk in response:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+            
+            # Token usage arrives in the final chunk
+            if chunk.usage:
+                usage.update({
+                    'prompt_tokens': chunk.usage.prompt_tokens,
+                    'completion_tokens': chunk.usage.completion_tokens,
+                    'total_tokens': chunk.usage.total_tokens
+                })
+    
+    def build_messages(self, prompt, system=None):
+        """Build chat messages, with the static system message first"""
+        messages = [{"role": "user", "content": prompt}]
+        if system:
+            messages.insert(0, {"role": "system", "content": system})
+        return messages
+    
     def calculate_openai_cost(self, model, prompt_tokens, completion_tokens):
         """Calculate the cost of OpenAI API call"""
         if model not in self.pricing:
@@ -178,30 +700,11 @@ Answer:
         Returns:
             tuple: (relevance, explanation, eval_prompt_tokens, eval_completion_tokens, eval_total_tokens)
         """
-        prompt_template = """
-You are an expert evaluator for a Retrieval-Augmented Generation (RAG) system.
-Your task is to analyze the relevance of the generated answer to the given question.
-Based on the relevance of the generated answer, you will classify it
-as "NON_RELEVANT", "PARTLY_RELEVANT", or "RELEVANT".
-
-Here is the data for evaluation:
-
-Question: {question}
-Generated Answer: {answer}
-
-Please analyze the content and context of the generated answer in relation to the question
-and provide your evaluation in parsable JSON without using code blocks:
-
-{{
-  "Relevance": "NON_RELEVANT" | "PARTLY_RELEVANT" | "RELEVANT",
-  "Explanation": "[Provide a brief explanation for your evaluation]"
-}}
-""".strip()
-        
-        prompt = prompt_template.format(question=question, answer=answer)
+        prompt = EVALUATION_TEMPLATE.format(question=question, answer=answer)
         
         try:
-            evaluation, eval_prompt_tokens, eval_completion_tokens, eval_total_tokens = self.llm(prompt, model='gpt-4o')
+            evaluation, eval_prompt_tokens, eval_completion_tokens, eval_total_tokens = \
+                self.llm(prompt, model=EVALUATION_MODEL, system=EVALUATION_INSTRUCTIONS, json_output=True)
             
             # Parse JSON response
             eval_json = json.loads(evaluation)
@@ -210,32 +713,153 @@ and provide your evaluation in parsable JSON without using code blocks:
             
             return relevance, explanation, eval_prompt_tokens, eval_completion_tokens, eval_total_tokens
         except Exception as e:
-            print(f"Error evaluating relevance: {e}")
+            logger.error("Error evaluating relevance: %s", e)
             return 'UNKNOWN', f'Error: {str(e)}', 0, 0, 0
     
-    def rewrite_query(self, user_query):
+    def batch_evaluate_relevance(self, pairs):
+        """
+        Evaluate several answers in one request, sharing the instructions
+        
+        Args:
+            pairs: List of (question, answer) tuples
+            
+        Returns:
+            tuple: (list of (relevance, explanation) in the order of pairs,
+                    eval_prompt_tokens, eval_completion_tokens, eval_total_tokens)
+        """
+        if not pairs:
+            return [], 0, 0, 0
+        
+        prompt = "\n\n".join(
+            EVALUATION_TEMPLATE.format(question=question, answer=answer)
+            for question, answer in pairs
+        )
+        
+        try:
+            evaluation, eval_prompt_tokens, eval_completion_tokens, eval_total_tokens = \
+                self.llm(prompt, model=EVALUATION_MODEL, system=BATCH_EVALUATION_INSTRUCTIONS)
+            
+            # Parse JSON response
+            eval_json = json.loads(evaluation)
+            if len(eval_json) != len(pairs):
+                raise ValueError(f"expected {len(pairs)} evaluations, got {len(eval_json)}")
+            
+            evaluations = [
+                (item.get('Relevance', 'UNKNOWN'), item.get('Explanation', 'No explanation provided'))
+                for item in eval_json
+            ]
+            return evaluations, eval_prompt_tokens, eval_completion_tokens, eval_total_tokens
+        except Exception as e:
+            logger.error("Error evaluating relevance: %s", e)
+            return [('UNKNOWN', f'Error: {str(e)}')] * len(pairs), 0, 0, 0
+    
+    def expand_query(self, user_query):
+        """
+        Append documentation terms after kubectl short names and abbreviations
+        
+        Args:
+            user_query: User's question
+            
+        Returns:
+            Query text for retrieval, e.g. "scale my sts" -> "scale my sts statefulset"
+            and "restart deploy/web" -> "restart deploy/web deployment"
+        """
+        words = []
+        for word in user_query.split():
+            words.append(word)
+            token = word.strip('.,;:!?()"\'').lower()
+            kind, slash, _ = token.partition('/')
+            if slash:
+                expansion = RESOURCE_REFERENCE_EXPANSIONS.get(kind)
+            else:
+                expansion = QUERY_EXPANSIONS.get(token)
+            if expansion:
+                words.append(expansion)
+        
+        return ' '.join(words)
+
+    def query_variants_prompt(self, user_query, num_variants):
         prompt = f"""
-        Rewrite the following Kubernetes-related question so that it matches documentation terminology and includes key Kubernetes resource names:
+        Write {num_variants} different rephrasings of the following Kubernetes-related question, using documentation terminology and key Kubernetes resource names:
         "{user_query}"
-        Return only the rewritten query.
+        Return only the rephrased questions, one per line, without numbering.
         """
 
         return prompt
 
+    def _query_variants(self, user_query, num_variants):
+        """
+        Get the query plus LLM-generated reformulations of it
+        
+        Returns:
+            tuple: (variants, usage dict of the LLM call)
+        """
+        response, prompt_tokens, completion_tokens, total_tokens = \
+            self.llm(self.query_variants_prompt(user_query, num_variants))
+        variants = [line.strip() for line in response.splitlines() if line.strip()]
+        usage = {
+            'prompt_tokens': prompt_tokens,
+            'completion_tokens': completion_tokens,
+            'total_tokens': total_tokens
+        }
+        return tuple([user_query] + variants[:num_variants]), usage
+
+    def answer_cache_key(self, user_query):
+        """Build a content-addressed cache key for a query, the pipeline version and the retrieval settings"""
+        key = "|".join([
+            PROMPT_VERSION,
+            "gpt-4o",
+            self.model_name,
+            self.encoder_backend,
+            str(self.encoder_onnx_file),
+            self.index_name,
+            self.search_template_id,
+            str(self.multi_query_variants),
+            EXPANSIONS_DIGEST,
+            user_query.strip()
+        ])
+        return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
     def query(self, user_query):
         """
-        Main RAG pipeline: encode query, search, build prompt, get answer
+        Main RAG pipeline: expand query, encode, search, build prompt, get answer
+        
+        The relevance evaluation depends only on the answer, so it is started in
+        the background and returned as a future under 'evaluation'. Call
+        finish_evaluation() to wait for it and fill in the relevance fields.
         
         Args:
             user_query: User's question
             
         Returns:
-            dict: Contains answer, search_results, metrics, and relevance evaluation
+            dict: Contains answer, search_results, metrics, and pending relevance evaluation
+        """
+        result = self.query_stream(user_query)
+        for _ in result.pop('answer_stream'):
+            pass
+        
+        return result
+
+    def query_stream(self, user_query):
+        """
+        Run retrieval and start streaming the answer
+        
+        The returned dict holds search_results and an 'answer_stream' generator
+        of answer text chunks. Once the stream is exhausted, the dict is
+        completed with the same fields query() returns.
+        
+        Args:
+            user_query: User's question
+            
+        Returns:
+            dict: Contains search_results and answer_stream
         """
         start_time = time.time()
         
-        # Recheck if index exists (in case it was created after initialization)
-        self.index_exists = self.check_index_exists()
+        # Recheck if index exists (in case it was created after initialization);
+        # once found, only re-verify it every index_check_ttl seconds
+        if not self.index_exists or time.monotonic() - self.index_checked_at > self.index_check_ttl:
+            self.index_exists = self.check_index_exists()
         
         # Check if index exists
         if not self.index_exists:
@@ -245,52 +869,150 @@ and provide your evaluation in parsable JSON without using code blocks:
             )
             raise Exception(error_msg)
 
-        # Rewrite user query from LLM
-        user_query_prompt = self.rewrite_query(user_query)
-        user_query_llm, user_prompt_tokens, user_completion_tokens, user_total_tokens = self.llm(prompt=user_query_prompt,  model='gpt-4o')
-        print("User query rewritten: ", user_query_llm)
+        # Serve repeated questions from the answer cache
+        cache_key = self.answer_cache_key(user_query)
+        cached = self.answer_cache.get(cache_key)
+        if cached is not None:
+            return self.cached_result(cached, start_time)
+
+        # Expand abbreviations locally instead of rewriting the query with an LLM
+        search_query = self.expand_query(user_query)
+        logger.debug("User query expanded: %r", search_query)
         
         # Encode query to vector
-        v_q = self.model.encode(user_query_llm)
-        print("Vector encoding done")
+        v_q = self.encode_query(search_query)
+        logger.debug("Vector encoding done")
         
-        # Search Elasticsearch
-        search_results = self.elastic_search('title_vector', user_query_llm, v_q)
-        print("Search results from elastic: ", search_results)
+        # Serve near-duplicate questions from the semantic cache
+        if self.semantic_cache is not None:
+            cached, score = self.semantic_cache.search(v_q)
+            if cached is not None:
+                logger.debug("Semantic cache hit (similarity %.3f)", score)
+                return self.cached_result(cached, start_time)
+        
+        variant_usage = None
+        try:
+            if self.multi_query_variants:
+                # Search with several reformulations in one request
+                variants, cached_usage = self.cached_query_variants(user_query, self.multi_query_variants)
+                # Memoized calls share one usage dict; only the request that made
+                # the LLM call is charged for it
+                variant_usage = {key: cached_usage.pop(key, 0) for key in list(cached_usage)}
+                queries = (search_query,) + variants[1:]
+                search_results = self.multi_query_search('title_vector', queries)
+            else:
+                # Search Elasticsearch
+                search_results = self.elastic_search('title_vector', search_query, v_q)
+        except NotFoundError:
+            # The index or stored search template disappeared; re-check both next time
+            self.index_exists = False
+            self.search_template_stored = False
+            raise
+        logger.debug("Search results from elastic: %r", search_results)
+        
+        # Never ask the LLM to answer without context
+        if not search_results:
+            raise Exception("No documents were retrieved for the question.")
         
         # Build prompt with context
-        prompt = self.build_prompt(user_query_llm, search_results)
-        print("Prompt: ", prompt)
+        prompt = self.build_prompt(user_query, search_results)
+        logger.debug("Prompt: %s", prompt)
+        
+        result = {'search_results': search_results, 'cache': False}
+        result['answer_stream'] = self.stream_answer(user_query, prompt, start_time, result, variant_usage)
+        return result
+
+    def cached_result(self, cached, start_time):
+        """Build a query result from a cached one; no OpenAI tokens were spent on it"""
+        result = dict(cached)
+        result.update({
+            'response_time': time.time() - start_time,
+            'prompt_tokens': 0,
+            'completion_tokens': 0,
+            'total_tokens': 0,
+            'eval_prompt_tokens': 0,
+            'eval_completion_tokens': 0,
+            'eval_total_tokens': 0,
+            'openai_cost': 0.0,
+            'cache': True,
+            'answer_stream': iter([result['answer']])
+        })
+        return result
+
+    def stream_answer(self, user_query, prompt, start_time, result, variant_usage=None):
+        """
+        Yield answer chunks from the LLM, then complete the result with the
+        answer, metrics and the pending relevance evaluation
+        
+        variant_usage holds the tokens spent generating query reformulations
+        for this request, which are added to the answer's token counts and cost.
+        """
+        usage = {'prompt_tokens': 0, 'completion_tokens': 0, 'total_tokens': 0}
+        chunks = []
+        for chunk in self.llm_stream(prompt, usage, system=ANSWER_INSTRUCTIONS):
+            chunks.append(chunk)
+            yield chunk
         
-        # Get answer from LLM with token tracking
-        answer, prompt_tokens, completion_tokens, total_tokens = self.llm(prompt)
-        print("Answer: ", answer)
+        # The reformulations come from the same model as the answer
+        if variant_usage:
+            for key, tokens in variant_usage.items():
+                usage[key] += tokens
+        
+        answer = "".join(chunks)
+        logger.debug("Answer: %s", answer)
         
         # Calculate response time
         response_time = time.time() - start_time
         
         # Calculate OpenAI cost
-        openai_cost = self.calculate_openai_cost('gpt-4o', prompt_tokens, completion_tokens)
+        openai_cost = self.calculate_openai_cost('gpt-4o', usage['prompt_tokens'], usage['completion_tokens'])
+        
+        # Evaluate relevance in the background
+        evaluation = self.executor.submit(self.evaluate_relevance, user_query, answer)
+        
+        result.update({
+            'answer': answer,
+            'response_time': response_time,
+            'prompt_tokens': usage['prompt_tokens'],
+            'completion_tokens': usage['completion_tokens'],
+            'total_tokens': usage['total_tokens'],
+            'openai_cost': openai_cost,
+            'evaluation': evaluation
+        })
+
+    def finish_evaluation(self, user_query, result):
+        """
+        Wait for the background relevance evaluation and merge it into the result
+        
+        Args:
+            user_query: User's question, as passed to query()
+            result: Dict returned by query()
+            
+        Returns:
+            dict: The result with relevance, eval token counts and total cost filled in
+        """
+        # Results served from the answer cache are already complete
+        if 'evaluation' not in result:
+            return result
         
-        # Evaluate relevance
         relevance, explanation, eval_prompt_tokens, eval_completion_tokens, eval_total_tokens = \
-            self.evaluate_relevance(user_query_llm, answer)
+            result.pop('evaluation').result()
         
         # Calculate total cost including evaluation
-        total_eval_cost = self.calculate_openai_cost('gpt-4o', eval_prompt_tokens, eval_completion_tokens)
-        total_cost = openai_cost + total_eval_cost
+        total_eval_cost = self.calculate_openai_cost(EVALUATION_MODEL, eval_prompt_tokens, eval_completion_tokens)
         
-        return {
-            'answer': answer,
-            'search_results': search_results,
-            'response_time': response_time,
+        result.update({
             'relevance': relevance,
             'relevance_explanation': explanation,
-            'prompt_tokens': prompt_tokens,
-            'completion_tokens': completion_tokens,
-            'total_tokens': total_tokens,
             'eval_prompt_tokens': eval_prompt_tokens,
             'eval_completion_tokens': eval_completion_tokens,
             'eval_total_tokens': eval_total_tokens,
-            'openai_cost': total_cost
-        }
\ No newline at end of file
+            'openai_cost': result['openai_cost'] + total_eval_cost
+        })
+        # Don't pin answers whose evaluation failed; they may come from a failed retrieval
+        if relevance != 'UNKNOWN':
+            self.answer_cache.set(self.answer_cache_key(user_query), result, expire=self.answer_cache_ttl)
+            if self.semantic_cache is not None:
+                self.semantic_cache.add(self.encode_query(self.expand_query(user_query)), dict(result))
+        
+        return result
\ No newline at end of file